@@ -90,9 +90,14 @@ def run_csv_excel_processing(input_path, output_path):
         logger.info("Usage: python main.py <input_file_path> [output_file_path]")
         sys.exit(1)
 
+    from utils.postgres_process import PostgresProcess
+
     processor = FileProcessor()
-    
-    success = processor.process_file(input_path, output_path)
+
+    try:
+        success = processor.process_file(input_path, output_path)
+    finally:
+        PostgresProcess.close_pool()
 
     if success:
         logger.info("✅ Expense Exporter processing completed successfully")
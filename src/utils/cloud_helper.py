@@ -2,14 +2,26 @@ import os
 import re
 import boto3
 from abc import ABC, abstractmethod
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from azure.storage.blob import BlobServiceClient
 from azure.core.exceptions import AzureError
 from botocore.exceptions import BotoCoreError, ClientError
-from .config import CLOUD_PROVIDER
+from .config import CLOUD_PROVIDER, MAX_WORKERS
 from .config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, AWS_BUCKET_NAME,S3_UPLOAD_PREFIX
 from .config import AZURE_CONNECTION_STRING, AZURE_CONTAINER_NAME, AZURE_PDF_PATH
 from .logger import logger
 
+# Objects above the threshold are uploaded as parallel multipart parts. Invoice PDFs
+# rarely reach it, and every worker thread may run this many part uploads at once.
+S3_PART_CONCURRENCY = 2
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=S3_PART_CONCURRENCY,
+    use_threads=True,
+)
+
 class CloudHelper(ABC):
     """Abstract base class for cloud storage helpers-Defines the interface for uploading blobs and generating file URLs."""
 
@@ -18,6 +30,11 @@ class CloudHelper(ABC):
         """Upload a file to cloud storage."""
         pass
 
+    @abstractmethod
+    def upload_fileobj(self, fileobj, blob_name):
+        """Upload the contents of a binary file-like object to cloud storage."""
+        pass
+
     @abstractmethod
     def upload_output_file(self, output_file_path):
         """Upload a processed output file and return its public URL."""
@@ -83,7 +100,10 @@ class AwsHelper(CloudHelper):
         s3_config = {
             'aws_access_key_id': AWS_ACCESS_KEY_ID,
             'aws_secret_access_key': AWS_SECRET_ACCESS_KEY,
-            'region_name': AWS_REGION
+            'region_name': AWS_REGION,
+            # The client is shared by all worker threads, each of which may upload
+            # several parts at once; size its pool so no connection is discarded
+            'config': Config(max_pool_connections=max(10, MAX_WORKERS * S3_PART_CONCURRENCY)),
         }
 
         self.s3_client = boto3.client('s3', **s3_config)
@@ -100,7 +120,7 @@ class AwsHelper(CloudHelper):
                 return False
 
             # Perform upload
-            self.s3_client.upload_file(local_path, self.bucket_name, s3_key)
+            self.s3_client.upload_file(local_path, self.bucket_name, s3_key, Config=S3_TRANSFER_CONFIG)
 
             # Verify upload
             try:
@@ -115,6 +135,27 @@ class AwsHelper(CloudHelper):
             logger.error(f"Failed to upload {local_path} to S3: {e}", exc_info=True)
             return False
 
+    def upload_fileobj(self, fileobj, s3_key):
+        """Upload a binary file-like object to AWS S3 and verify upload success."""
+        try:
+            logger.debug("Uploading stream to S3: s3://%s/%s", self.bucket_name, s3_key)
+
+            # Perform upload
+            self.s3_client.upload_fileobj(fileobj, self.bucket_name, s3_key, Config=S3_TRANSFER_CONFIG)
+
+            # Verify upload
+            try:
+                self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+                logger.info(f"Uploaded successfully: s3://{self.bucket_name}/{s3_key}")
+                return True
+            except Exception as verify_err:
+                logger.error(f"Upload verification failed for s3://{self.bucket_name}/{s3_key}: {verify_err}")
+                return False
+
+        except (BotoCoreError, ClientError, Exception) as e:
+            logger.error(f"Failed to upload stream to s3://{self.bucket_name}/{s3_key}: {e}", exc_info=True)
+            return False
+
     def generate_presigned_url(self, s3_key, expiry_seconds=518400):
         """
         Generate a pre-signed S3 URL (valid for default 6 days).
@@ -127,7 +168,7 @@ class AwsHelper(CloudHelper):
                 Params={'Bucket': self.bucket_name, 'Key': s3_key},
                 ExpiresIn=expiry_seconds
             )
-            logger.debug(f"Generated pre-signed URL for {s3_key}")
+            logger.debug("Generated pre-signed URL for %s", s3_key)
             return url
         except Exception as e:
             logger.warning(f"Failed to generate pre-signed URL for {s3_key}: {e}")
@@ -179,7 +220,7 @@ class AwsHelper(CloudHelper):
 
             logger.debug(f"Uploading output file to S3: {output_file_path} → s3://{self.bucket_name}/{s3_key}")
 
-            self.s3_client.upload_file(output_file_path, self.bucket_name, s3_key)
+            self.s3_client.upload_file(output_file_path, self.bucket_name, s3_key, Config=S3_TRANSFER_CONFIG)
 
             # Verify upload
             self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
@@ -218,6 +259,18 @@ class AzureHelper(CloudHelper):
             logger.error(f"Error uploading file {local_path} to {blob_name}: {e}", exc_info=True)
             return False
 
+    def upload_fileobj(self, fileobj, blob_name):
+        """Upload a binary file-like object to Azure Blob Storage."""
+        try:
+            logger.debug("Uploading stream → %s", blob_name)
+            blob_client = self.blob_service.get_blob_client(self.container_name, blob_name)
+            blob_client.upload_blob(fileobj, overwrite=True)
+            logger.info(f"Uploaded stream → {blob_name}")
+            return True
+        except AzureError as e:
+            logger.error(f"Error uploading stream to {blob_name}: {e}", exc_info=True)
+            return False
+
     def get_file_url(self, blob_name):
         """Generate Azure Blob URL for the blob."""
         account_name = self._get_account_name()
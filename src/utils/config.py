@@ -78,6 +78,8 @@ DB_CONFIG = {
 }
 if not DB_CONFIG["dbname"]:
     raise ValueError("DB_NAME is missing from environment variables.")
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "4"))
 
 # === Cloud Provider Config ===
 CLOUD_PROVIDER = os.getenv("CLOUD_PROVIDER", "aws").lower()
@@ -112,6 +114,8 @@ OUTPUT_FILE_PATH = os.path.join(PROJECT_ROOT, output_file) if output_file else N
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
 MONGO_COLLECTION_NAME = os.getenv("MONGO_COLLECTION_NAME")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "32"))
+MONGO_UNACKNOWLEDGED_WRITES = os.getenv("MONGO_UNACKNOWLEDGED_WRITES", "0") == "1"
 
 # === Directories ===
 DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "downloads")
@@ -120,3 +124,7 @@ LOG_DIR = os.getenv("LOG_DIR", "logs")
 # === Client / Source ===
 CLIENT = os.getenv("CLIENT")
 SOURCE = os.getenv("SOURCE")
+
+# === Processing ===
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "16"))
+FAST_OUTPUT = os.getenv("FAST_OUTPUT", "0") == "1"
@@ -1,6 +1,8 @@
+import atexit
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
+import queue
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -42,14 +44,25 @@ console_handler = logging.StreamHandler()
 console_handler.setFormatter(formatter)
 console_handler.setLevel(logging.DEBUG)
 
+# Queue: callers only enqueue records, file/console I/O runs on the listener thread
+log_queue = queue.Queue(-1)
+queue_handler = QueueHandler(log_queue)
+listener = QueueListener(
+    log_queue,
+    debug_handler,
+    info_handler,
+    warning_handler,
+    error_handler,
+    console_handler,
+    respect_handler_level=True,
+)
+listener.start()
+atexit.register(listener.stop)
+
 # Root logger
 logger = logging.getLogger("expense_exporter")
 logger.setLevel(logging.DEBUG)
-logger.addHandler(debug_handler)
-logger.addHandler(info_handler)
-logger.addHandler(warning_handler)
-logger.addHandler(error_handler)
-logger.addHandler(console_handler)
+logger.addHandler(queue_handler)
 
 
 
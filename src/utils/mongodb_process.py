@@ -52,11 +52,14 @@ Handles all MongoDB database operations for the hotel expense exporter.
 Provides functions for connecting to MongoDB, inserting invoice data, and closing connections safely.
 """
 
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError
-from .config import MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION_NAME
+from pymongo import MongoClient, WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from bson.errors import InvalidDocument
+from .config import MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION_NAME, MONGO_MAX_POOL_SIZE, MONGO_UNACKNOWLEDGED_WRITES
 from .logger import logger
 
+# Raised while encoding a document to BSON (e.g. pd.NaT, datetime.date, ints over 64 bits)
+BSON_ENCODING_ERRORS = (InvalidDocument, ValueError, TypeError, OverflowError)
 
 class MongoDBProcess:
     """Class for handling MongoDB database operations."""
@@ -64,9 +67,13 @@ class MongoDBProcess:
     def __init__(self):
         """Initialize MongoDB client and database connection."""
         try:
-            self.client = MongoClient(MONGO_URI)
+            self.client = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE)
             self.db = self.client[MONGO_DB_NAME]
             self.collection = self.db[MONGO_COLLECTION_NAME]
+            if MONGO_UNACKNOWLEDGED_WRITES:
+                # Opt-in: the server no longer confirms inserts, so write errors are never reported
+                self.collection = self.collection.with_options(write_concern=WriteConcern(w=0))
+                logger.warning("MongoDB inserts are unacknowledged (w=0); failed writes will not be reported")
             # ✅ Avoid logging URI (security best practice)
             logger.info(f"Connected to MongoDB: {MONGO_DB_NAME}.{MONGO_COLLECTION_NAME}")
         except PyMongoError as e:
@@ -88,7 +95,60 @@ class MongoDBProcess:
             result = self.collection.insert_one(invoice_data)
             logger.info(f"Inserted invoice data into MongoDB with ID: {result.inserted_id}")
             return str(result.inserted_id)
+        except (PyMongoError, *BSON_ENCODING_ERRORS) as e:
+            logger.error(f"Failed to insert invoice data into MongoDB: {e}", exc_info=True)
+            return None
+
+    def insert_many_invoice_data(self, invoice_docs):
+        """
+        Insert a batch of invoice documents into MongoDB with one unordered insert_many.
+
+        Args:
+            invoice_docs (list[dict]): Invoice documents to insert.
+
+        Returns:
+            list: Inserted document ID (str) per input document, None where the insert failed.
+        """
+        if not invoice_docs:
+            return []
+        try:
+            result = self.collection.insert_many(invoice_docs, ordered=False)
+            if result.acknowledged:
+                logger.info(f"Inserted {len(result.inserted_ids)} invoice documents into MongoDB")
+            else:
+                logger.info(f"Sent {len(result.inserted_ids)} invoice documents to MongoDB (unacknowledged)")
+            return [str(inserted_id) for inserted_id in result.inserted_ids]
+        except BulkWriteError as e:
+            # Unordered inserts keep going past failures; only the reported indexes failed
+            failed = {err['index'] for err in e.details.get('writeErrors', [])}
+            logger.error(f"MongoDB batch insert failed for {len(failed)} of {len(invoice_docs)} documents: {e}", exc_info=True)
+            return [None if i in failed else str(doc['_id']) for i, doc in enumerate(invoice_docs)]
         except PyMongoError as e:
+            logger.error(f"Failed to insert invoice batch into MongoDB: {e}", exc_info=True)
+            return [None] * len(invoice_docs)
+        except BSON_ENCODING_ERRORS as e:
+            # One document cannot be encoded; retry one at a time so only that document fails
+            logger.error(f"MongoDB batch insert failed, retrying {len(invoice_docs)} documents individually: {e}", exc_info=True)
+            return [self._insert_after_failed_batch(doc) for doc in invoice_docs]
+
+    def _insert_after_failed_batch(self, invoice_doc):
+        """
+        Insert one document of a batch that failed part-way through.
+
+        Batches are sent in pieces, so some documents may already be stored; their
+        _id then collides on retry and the stored copy is reported as inserted.
+
+        Returns:
+            str or None: Document ID on success, None on failure.
+        """
+        try:
+            return str(self.collection.insert_one(invoice_doc).inserted_id)
+        except DuplicateKeyError as e:
+            if '_id' in invoice_doc and (e.details or {}).get('keyPattern') == {'_id': 1}:
+                return str(invoice_doc['_id'])
+            logger.error(f"Failed to insert invoice data into MongoDB: {e}", exc_info=True)
+            return None
+        except (PyMongoError, *BSON_ENCODING_ERRORS) as e:
             logger.error(f"Failed to insert invoice data into MongoDB: {e}", exc_info=True)
             return None
 
@@ -1,137 +1,100 @@
-# import psycopg2
-# from .config import DB_CONFIG
-# from .logger import logger
-
-# class PostgresProcess:
-#     """Class for handling PostgreSQL database operations."""
-    
-#     @staticmethod
-#     def get_db_connection():
-#         """
-#         Establish a connection to the PostgreSQL database.
-#         """
-#         logger.debug("Establishing PostgreSQL database connection")
-#         return psycopg2.connect(**DB_CONFIG)
-    
-#     @staticmethod
-#     def insert_file_metadata(file_url, source, client_name, file_hash):
-#         """
-#         Insert file metadata into the hotel_invoice table.
-#         Checks for duplicates based on file_hash and updates updated_on if duplicate.
-
-#         Returns:
-#             dict or None: {"id": str, "is_duplicate": bool} on success, None on failure.
-#         """
-#         try:
-#             with PostgresProcess.get_db_connection() as conn:
-#                 with conn.cursor() as cur:
-#                     logger.debug(f"Checking if hash exists: {file_hash}")
-#                     cur.execute("SELECT id FROM hotel_invoice WHERE file_hash = %s", (file_hash,))
-#                     existing = cur.fetchone()
-
-#                     if existing:
-#                         record_id = existing[0]
-#                         # Update updated_on for duplicate file
-#                         cur.execute("""
-#                             UPDATE hotel_invoice
-#                             SET updated_on = CURRENT_TIMESTAMP
-#                             WHERE id = %s
-#                         """, (record_id,))
-#                         conn.commit()
-#                         logger.info(f"Duplicate file detected. Refreshed updated_on for record {record_id}")
-#                         return {"id": str(record_id), "is_duplicate": True}
-
-#                     logger.debug(f"Inserting new record for {file_url}")
-#                     cur.execute("""
-#                         INSERT INTO hotel_invoice (file_url, source, client_name, file_hash, status, updated_on)
-#                         VALUES (%s, %s, %s, %s, 'PENDING', CURRENT_TIMESTAMP)
-#                         RETURNING id
-#                     """, (file_url, source, client_name, file_hash))
-#                     conn.commit()
-#                     record_id = cur.fetchone()[0]
-#                     logger.info(f"Inserted new record {record_id} for {file_url}")
-#                     return {"id": str(record_id), "is_duplicate": False}
-#         except Exception as e:
-#             logger.error(f"PostgreSQL insert failed for {file_url}: {e}", exc_info=True)
-#             return None
-
-#     @staticmethod
-#     def insert_full_invoice_data(invoice_data):
-#         """
-#         Insert full invoice data into the hotel_invoice table.
-#         Checks for duplicates based on file_hash and updates updated_on if duplicate.
-
-#         Args:
-#             invoice_data (dict): Invoice data to insert.
-
-#         Returns:
-#             dict or None: {"id": str, "is_duplicate": bool} on success, None on failure.
-#         """
-#         try:
-#             with PostgresProcess.get_db_connection() as conn:
-#                 with conn.cursor() as cur:
-#                     file_hash = invoice_data.get('file_hash')
-#                     logger.debug(f"Checking if hash exists: {file_hash}")
-#                     cur.execute("SELECT id FROM hotel_invoice WHERE file_hash = %s", (file_hash,))
-#                     existing = cur.fetchone()
-
-#                     if existing:
-#                         record_id = existing[0]
-#                         # The 'updated_on' field is now updated automatically by a database trigger.
-#                         # We can simply log and return. If we needed to update other fields, we would do it here.
-#                         cur.execute("""
-#                             -- This query is just to ensure the trigger fires if we need to log an update.
-#                             -- For now, we can just log that a duplicate was found.
-#                             SELECT id FROM hotel_invoice WHERE id = %s
-#                         """, (record_id,))
-#                         conn.commit()
-#                         logger.info(f"Duplicate file detected. Refreshed updated_on for record {record_id}")
-#                         return {"id": str(record_id), "is_duplicate": True}
-
-#                     logger.debug(f"Inserting new invoice record")
-
-#                     # Build the INSERT query dynamically based on available fields
-#                     fields = []
-#                     values = []
-#                     placeholders = []
-
-#                     for field in ['source_id', 'source', 'client_name', 'file_url', 'file_hash', 'status',
-#                                 'match_status', '2b_id', 'booking_id', 'client_gstin', 'hotel_gstin',
-#                                 'invoice_number', 'invoice_date', 'gst_amount', 'remarks', 'followup_tracking_id']:
-#                         if field in invoice_data and invoice_data[field] is not None:
-#                             fields.append(f'"{field}"')  # Quote field names to handle special characters/names
-#                             values.append(invoice_data[field])
-#                             placeholders.append('%s')
-
-#                     query = f"""
-#                         INSERT INTO hotel_invoice ({', '.join(fields)}, "updated_on")
-#                         VALUES ({', '.join(placeholders)}, CURRENT_TIMESTAMP)
-#                         RETURNING id
-#                     """
-
-#                     cur.execute(query, values)
-#                     conn.commit()
-#                     record_id = cur.fetchone()[0]
-#                     logger.info(f"Inserted new invoice record {record_id}")
-#                     return {"id": str(record_id), "is_duplicate": False}
-#         except Exception as e:
-#             logger.error(f"PostgreSQL full insert failed: {e}", exc_info=True)
-#             return None
-
-
+import io
+import csv
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 import psycopg2
-from .config import DB_CONFIG
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from .config import DB_CONFIG, PG_POOL_MIN_SIZE, PG_POOL_MAX_SIZE
 from .logger import logger
 
+# Table holding one row per invoice file; every statement below targets it
+INVOICE_TABLE = "hotel_invoice"
+STAGING_TABLE = f"{INVOICE_TABLE}_staging"
+
+# Columns of the invoice table that may be supplied by callers
+INVOICE_FIELDS = [
+    'source_id', 'source', 'client_name', 'file_url', 'file_hash', 'status',
+    'match_status', '2b_id', 'booking_id', 'client_gstin', 'hotel_gstin',
+    'invoice_number', 'invoice_date', 'gst_amount', 'remarks', 'followup_tracking_id'
+]
+
+# Relies on a unique index on the table's file_hash; see README. xmax is 0 only
+# for a freshly inserted row, so "inserted" tells new records from duplicates.
+ON_FILE_HASH_CONFLICT = "ON CONFLICT (file_hash) DO UPDATE SET updated_on = CURRENT_TIMESTAMP"
+UPSERT_ON_FILE_HASH = f"""
+    {ON_FILE_HASH_CONFLICT}
+    RETURNING id, (xmax = 0) AS inserted
+"""
+
+# Groups at least this large are loaded with COPY through a staging table
+COPY_MIN_ROWS = 1024
+
+
+@lru_cache(maxsize=256)
+def invoice_upsert_sql(fields):
+    """
+    Build the upsert statements for one set of invoice fields, once per field set.
+
+    Args:
+        fields (tuple): Invoice fields present on the record(s), in INVOICE_FIELDS order.
+
+    Returns:
+        tuple: (single-row SQL, execute_values SQL, execute_values row template).
+    """
+    columns = ', '.join(f'"{field}"' for field in fields)
+    template = f"({', '.join(['%s'] * len(fields))}, CURRENT_TIMESTAMP)"
+    insert = f'INSERT INTO {INVOICE_TABLE} ({columns}, "updated_on") VALUES'
+    return (f"{insert} {template} {UPSERT_ON_FILE_HASH}",
+            f"{insert} %s {UPSERT_ON_FILE_HASH}",
+            template)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
 
 class PostgresProcess:
     """Handles PostgreSQL database operations for invoice data."""
 
     @staticmethod
+    def get_pool():
+        """Return the shared connection pool, creating it on first use."""
+        global _pool
+        with _pool_lock:
+            if _pool is None or _pool.closed:
+                logger.debug("Creating PostgreSQL connection pool")
+                _pool = ThreadedConnectionPool(PG_POOL_MIN_SIZE, PG_POOL_MAX_SIZE, **DB_CONFIG)
+            return _pool
+
+    @staticmethod
+    def close_pool():
+        """Close every pooled connection. The pool is recreated on next use."""
+        global _pool
+        with _pool_lock:
+            if _pool is not None and not _pool.closed:
+                _pool.closeall()
+                logger.debug("Closed PostgreSQL connection pool")
+            _pool = None
+
+    @staticmethod
+    @contextmanager
     def get_db_connection():
-        """Establish a connection to the PostgreSQL database."""
-        logger.debug("Establishing PostgreSQL database connection")
-        return psycopg2.connect(**DB_CONFIG)
+        """
+        Borrow a warm connection from the pool for one transaction.
+
+        The transaction is committed when the block succeeds and rolled back
+        when it raises; the connection then goes back to the pool (or is
+        discarded if it was broken).
+        """
+        pool = PostgresProcess.get_pool()
+        conn = pool.getconn()
+        try:
+            with conn:
+                yield conn
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
 
     @staticmethod
     def insert_file_metadata(file_url, source, client_name, file_hash):
@@ -139,80 +102,210 @@ class PostgresProcess:
         try:
             with PostgresProcess.get_db_connection() as conn:
                 with conn.cursor() as cur:
-                    logger.debug(f"Checking if hash exists: {file_hash}")
-                    cur.execute("SELECT id FROM hotel_invoice WHERE file_hash = %s", (file_hash,))
-                    existing = cur.fetchone()
-
-                    if existing:
-                        record_id = existing[0]
-                        cur.execute("""
-                            UPDATE hotel_invoice
-                            SET updated_on = CURRENT_TIMESTAMP
-                            WHERE id = %s
-                        """, (record_id,))
-                        conn.commit()
-                        logger.info(f"Duplicate file detected. Refreshed updated_on for record {record_id}")
-                        return {"id": str(record_id), "is_duplicate": True}
-
-                    cur.execute("""
-                        INSERT INTO hotel_invoice (file_url, source, client_name, file_hash, status, updated_on)
+                    logger.debug("Upserting file metadata for hash: %s", file_hash)
+                    cur.execute(f"""
+                        INSERT INTO {INVOICE_TABLE} (file_url, source, client_name, file_hash, status, updated_on)
                         VALUES (%s, %s, %s, %s, 'PENDING', CURRENT_TIMESTAMP)
-                        RETURNING id
+                        {UPSERT_ON_FILE_HASH}
                     """, (file_url, source, client_name, file_hash))
-                    record_id = cur.fetchone()[0]
-                    conn.commit()
-                    logger.info(f"Inserted new record {record_id} for {file_url}")
-                    return {"id": str(record_id), "is_duplicate": False}
+                    record_id, inserted = cur.fetchone()
+                    if inserted:
+                        logger.info(f"Inserted new record {record_id} for {file_url}")
+                    else:
+                        logger.info(f"Duplicate file detected. Refreshed updated_on for record {record_id}")
+                    return {"id": str(record_id), "is_duplicate": not inserted}
         except Exception as e:
             logger.error(f"PostgreSQL insert failed for {file_url}: {e}", exc_info=True)
             return None
 
+    @staticmethod
+    def insert_many_file_metadata(file_rows, page_size=500):
+        """
+        Insert or refresh basic metadata for many files in a single transaction.
+
+        Args:
+            file_rows (list[tuple]): (file_url, source, client_name, file_hash) per file.
+            page_size (int): Rows per INSERT statement sent to the server.
+
+        Returns:
+            list: {"id": str, "is_duplicate": bool} per file in input order, or None if the batch failed.
+        """
+        if not file_rows:
+            return []
+        try:
+            with PostgresProcess.get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    # ON CONFLICT DO UPDATE cannot touch the same row twice in one statement
+                    first_pos = {}
+                    unique_rows = []
+                    for pos, row in enumerate(file_rows):
+                        file_hash = row[3]
+                        if file_hash is None or file_hash not in first_pos:
+                            first_pos[file_hash] = pos
+                            unique_rows.append(pos)
+
+                    rows = execute_values(
+                        cur,
+                        f"""
+                            INSERT INTO {INVOICE_TABLE} (file_url, source, client_name, file_hash, status, updated_on)
+                            VALUES %s
+                            {UPSERT_ON_FILE_HASH}
+                        """,
+                        [file_rows[pos] for pos in unique_rows],
+                        template="(%s, %s, %s, %s, 'PENDING', CURRENT_TIMESTAMP)",
+                        page_size=page_size,
+                        fetch=True,
+                    )
+                    results = [None] * len(file_rows)
+                    for pos, (record_id, inserted) in zip(unique_rows, rows):
+                        results[pos] = {"id": str(record_id), "is_duplicate": not inserted}
+                    for pos, row in enumerate(file_rows):
+                        if results[pos] is None:
+                            results[pos] = {"id": results[first_pos[row[3]]]["id"], "is_duplicate": True}
+
+                    inserted = sum(1 for r in results if not r["is_duplicate"])
+                    logger.info(f"Inserted {inserted} new file records in batch of {len(file_rows)}")
+                    return results
+        except Exception as e:
+            logger.error(f"PostgreSQL batch file metadata insert failed: {e}", exc_info=True)
+            return None
+
     @staticmethod
     def insert_full_invoice_data(invoice_data):
         """Insert or update a full invoice record into the hotel_invoice table."""
         try:
             with PostgresProcess.get_db_connection() as conn:
                 with conn.cursor() as cur:
-                    file_hash = invoice_data.get('file_hash')
-                    logger.debug(f"Checking if hash exists: {file_hash}")
-                    cur.execute("SELECT id FROM hotel_invoice WHERE file_hash = %s", (file_hash,))
-                    existing = cur.fetchone()
-
-                    if existing:
-                        record_id = existing[0]
-                        # Explicit update to maintain compatibility across DBs
-                        cur.execute("""
-                            UPDATE hotel_invoice
-                            SET updated_on = CURRENT_TIMESTAMP
-                            WHERE id = %s
-                        """, (record_id,))
-                        conn.commit()
+                    logger.debug("Upserting invoice for hash: %s", invoice_data.get('file_hash'))
+
+                    fields = tuple(f for f in INVOICE_FIELDS if invoice_data.get(f) is not None)
+                    query = invoice_upsert_sql(fields)[0]
+                    cur.execute(query, [invoice_data[field] for field in fields])
+                    record_id, inserted = cur.fetchone()
+                    if inserted:
+                        logger.info(f"Inserted new invoice record {record_id}")
+                    else:
                         logger.info(f"Duplicate file detected. Refreshed updated_on for record {record_id}")
-                        return {"id": str(record_id), "is_duplicate": True}
-
-                    # Build insert dynamically
-                    fields, values, placeholders = [], [], []
-                    for field in [
-                        'source_id', 'source', 'client_name', 'file_url', 'file_hash', 'status',
-                        'match_status', '2b_id', 'booking_id', 'client_gstin', 'hotel_gstin',
-                        'invoice_number', 'invoice_date', 'gst_amount', 'remarks', 'followup_tracking_id'
-                    ]:
-                        if field in invoice_data and invoice_data[field] is not None:
-                            fields.append(f'"{field}"')
-                            values.append(invoice_data[field])
-                            placeholders.append('%s')
-
-                    query = f"""
-                        INSERT INTO hotel_invoice ({', '.join(fields)}, "updated_on")
-                        VALUES ({', '.join(placeholders)}, CURRENT_TIMESTAMP)
-                        RETURNING id
-                    """
-
-                    cur.execute(query, values)
-                    record_id = cur.fetchone()[0]
-                    conn.commit()
-                    logger.info(f"Inserted new invoice record {record_id}")
-                    return {"id": str(record_id), "is_duplicate": False}
+                    return {"id": str(record_id), "is_duplicate": not inserted}
         except Exception as e:
             logger.error(f"PostgreSQL full insert failed: {e}", exc_info=True)
             return None
+
+    @staticmethod
+    def insert_full_invoice_data_bulk(invoice_records, page_size=500):
+        """
+        Insert or refresh a batch of invoice records in a single transaction.
+
+        Records are upserted with execute_values (or COPY for large groups), grouped
+        by their set of non-null fields so omitted columns keep their defaults. Records whose file_hash already
+        exists only get updated_on refreshed; a hash repeated within the batch is sent
+        once and its later records share the result. If the batch fails, it is rolled
+        back and retried one record at a time so a single bad record only fails itself.
+
+        Args:
+            invoice_records (list[dict]): Invoice data to insert.
+            page_size (int): Rows per INSERT statement sent to the server.
+
+        Returns:
+            list: {"id": str, "is_duplicate": bool} per record, or None for records that could not be stored.
+        """
+        if not invoice_records:
+            return []
+        try:
+            with PostgresProcess.get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    results = [None] * len(invoice_records)
+                    # ON CONFLICT DO UPDATE cannot touch the same row twice in one statement
+                    first_new = {}
+                    batch_duplicates = []
+                    groups = {}
+                    for pos, record in enumerate(invoice_records):
+                        file_hash = record.get('file_hash')
+                        if file_hash is not None and file_hash in first_new:
+                            batch_duplicates.append((pos, first_new[file_hash]))
+                        else:
+                            if file_hash is not None:
+                                first_new[file_hash] = pos
+                            fields = tuple(f for f in INVOICE_FIELDS if record.get(f) is not None)
+                            groups.setdefault(fields, []).append(pos)
+
+                    for fields, positions in groups.items():
+                        if 'file_hash' in fields and len(positions) >= COPY_MIN_ROWS:
+                            rows = PostgresProcess.copy_upsert_invoices(
+                                cur, fields, [invoice_records[pos] for pos in positions])
+                            for pos in positions:
+                                record_id, inserted = rows[invoice_records[pos]['file_hash']]
+                                results[pos] = {"id": str(record_id), "is_duplicate": not inserted}
+                            continue
+
+                        _, query, template = invoice_upsert_sql(fields)
+                        rows = execute_values(
+                            cur,
+                            query,
+                            [tuple(invoice_records[pos][field] for field in fields) for pos in positions],
+                            template=template,
+                            page_size=page_size,
+                            fetch=True,
+                        )
+                        for pos, (record_id, inserted) in zip(positions, rows):
+                            results[pos] = {"id": str(record_id), "is_duplicate": not inserted}
+
+                    for pos, first_pos in batch_duplicates:
+                        results[pos] = {"id": results[first_pos]["id"], "is_duplicate": True}
+
+                    inserted = sum(1 for r in results if not r["is_duplicate"])
+                    if inserted < len(invoice_records):
+                        logger.info(f"Duplicate files detected. Refreshed updated_on for "
+                                    f"{len(invoice_records) - inserted} records")
+                    logger.info(f"Inserted {inserted} new invoice records in batch of {len(invoice_records)}")
+                    return results
+        except psycopg2.OperationalError as e:
+            # Connection-level failures would only repeat for every single record
+            logger.error(f"PostgreSQL bulk insert failed: {e}", exc_info=True)
+            return [None] * len(invoice_records)
+        except Exception as e:
+            logger.error(f"PostgreSQL bulk insert failed, retrying {len(invoice_records)} records individually: {e}", exc_info=True)
+            return [PostgresProcess.insert_full_invoice_data(record) for record in invoice_records]
+
+    @staticmethod
+    def copy_upsert_invoices(cur, fields, invoice_records):
+        """
+        Upsert many invoice records through COPY into a temporary staging table.
+
+        COPY skips per-row statement parsing, so it beats execute_values once a batch
+        runs into the thousands. The staging table is dropped at commit.
+
+        Args:
+            cur: Cursor of the open transaction.
+            fields (tuple): Columns to load; must include file_hash.
+            invoice_records (list[dict]): Records with a distinct, non-null file_hash.
+
+        Returns:
+            dict: file_hash -> (id, inserted) for every record.
+        """
+        columns = ', '.join(f'"{field}"' for field in fields)
+        # Same column types as the invoice table, but no defaults or constraints to trip over.
+        # Recreated per call because each field group has its own columns.
+        # Always schema-qualified, so a permanent table of the same name is never touched
+        cur.execute(f"DROP TABLE IF EXISTS pg_temp.{STAGING_TABLE}")
+        cur.execute(f"""
+            CREATE TEMP TABLE {STAGING_TABLE} ON COMMIT DROP AS
+            SELECT {columns} FROM {INVOICE_TABLE} WITH NO DATA
+        """)
+
+        buf = io.StringIO()
+        # Quote everything: in COPY's CSV format an unquoted empty field means NULL
+        writer = csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerows(tuple(record[field] for field in fields) for record in invoice_records)
+        buf.seek(0)
+        cur.copy_expert(f"COPY pg_temp.{STAGING_TABLE} ({columns}) FROM STDIN WITH (FORMAT CSV)", buf)
+
+        cur.execute(f"""
+            INSERT INTO {INVOICE_TABLE} ({columns}, "updated_on")
+            SELECT {columns}, CURRENT_TIMESTAMP FROM pg_temp.{STAGING_TABLE}
+            {ON_FILE_HASH_CONFLICT}
+            RETURNING id, (xmax = 0) AS inserted, file_hash
+        """)
+        rows = {file_hash: (record_id, inserted) for record_id, inserted, file_hash in cur.fetchall()}
+        logger.debug(f"Copied {len(invoice_records)} invoice records through staging table")
+        return rows
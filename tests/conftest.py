@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+# config.py refuses to import without a database name; tests never connect
+os.environ.setdefault("DB_NAME", "expense_exporter_test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+SAMPLE_WORKBOOK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_expense.xlsx")
+
+
+class FakeMongo:
+    """In-memory stand-in for MongoDBProcess."""
+
+    def __init__(self):
+        self.docs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def insert_many_invoice_data(self, invoice_docs):
+        self.docs.extend(invoice_docs)
+        return [f"id{i}" for i in range(len(self.docs) - len(invoice_docs), len(self.docs))]
+
+
+class FakePostgres:
+    """In-memory stand-in for PostgresProcess."""
+
+    records = []
+
+    @staticmethod
+    def insert_full_invoice_data_bulk(invoice_records):
+        FakePostgres.records.extend(invoice_records)
+        return [{"id": str(i), "is_duplicate": False} for i in range(len(invoice_records))]
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    """A FileProcessor in test-bypass mode whose database writes stay in memory."""
+    from utils import file_process
+
+    FakePostgres.records = []
+    monkeypatch.setattr(file_process, "MongoDBProcess", FakeMongo)
+    monkeypatch.setattr(file_process, "PostgresProcess", FakePostgres)
+    monkeypatch.setattr(file_process, "TEST_BYPASS_DOWNLOAD_AND_UPLOAD", True)
+    return file_process.FileProcessor()
+
+
+@pytest.fixture
+def sample_workbook():
+    return SAMPLE_WORKBOOK
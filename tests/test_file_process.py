@@ -0,0 +1,261 @@
+import pandas as pd
+
+
+def test_parquet_output_from_sample_workbook(processor, sample_workbook, tmp_path):
+    output = tmp_path / "processed.parquet"
+
+    assert processor.process_file(sample_workbook, str(output)) is True
+
+    result = pd.read_parquet(output)
+    source = pd.read_excel(sample_workbook)
+    assert len(result) >= len(source)
+    assert {'s3_link', 'status', 'file_hash'} <= set(result.columns)
+    # Mixed int/str columns are written as text, missing values stay null
+    assert pd.api.types.is_string_dtype(result['HOTEL_INV_NO'])
+    assert result['HOTEL_INV_NO'].isna().sum() == source['HOTEL_INV_NO'].isna().sum()
+    assert not (tmp_path / "processed.partial.parquet").exists()
+
+
+def test_parquet_sidecar_round_trips(processor, sample_workbook, tmp_path, monkeypatch):
+    from utils import file_process
+
+    monkeypatch.setattr(file_process, "FAST_OUTPUT", True)
+    output = tmp_path / "processed.xlsx"
+
+    assert processor.process_file(sample_workbook, str(output)) is True
+
+    sidecar = tmp_path / "processed.xlsx.parquet"
+    assert sidecar.exists()
+    excel = pd.read_excel(output)
+    parquet = pd.read_parquet(sidecar)
+    assert list(parquet.columns) == list(excel.columns)
+    assert len(parquet) == len(excel)
+    assert parquet['status'].tolist() == excel['status'].tolist()
+    assert parquet['file_hash'].fillna('').tolist() == excel['file_hash'].fillna('').tolist()
+
+
+def test_parquet_keeps_int_float_columns_numeric(processor, tmp_path):
+    output = tmp_path / "typed.parquet"
+    df = pd.DataFrame({
+        'AMOUNT': pd.Series([100, 250.5, None], dtype=object),
+        'HOTEL_INV_NO': pd.Series([1001, 'INV-2', None], dtype=object),
+        'NOTE': pd.Series([1.5, 'n/a', None], dtype=object),
+    })
+
+    processor._write_parquet(df, str(output))
+
+    result = pd.read_parquet(output)
+    assert result['AMOUNT'].dtype == 'float64'
+    assert result['AMOUNT'].tolist()[:2] == [100.0, 250.5]
+    assert pd.api.types.is_string_dtype(result['HOTEL_INV_NO'])
+    assert pd.api.types.is_string_dtype(result['NOTE'])
+    assert result['NOTE'].isna().tolist() == [False, False, True]
+
+def _stream_excel(processor, path):
+    return pd.concat(list(processor._stream_excel_rows(str(path))), ignore_index=True)
+
+
+def test_openpyxl_fallback_matches_read_excel_on_sample(processor, sample_workbook):
+    expected = pd.read_excel(sample_workbook, engine='openpyxl', dtype=object)
+
+    pd.testing.assert_frame_equal(_stream_excel(processor, sample_workbook), expected)
+
+
+def test_calamine_and_openpyxl_paths_agree(processor, sample_workbook):
+    calamine = pd.concat(list(processor._read_excel(sample_workbook)), ignore_index=True)
+
+    pd.testing.assert_frame_equal(calamine, _stream_excel(processor, sample_workbook))
+
+
+def test_openpyxl_fallback_matches_read_excel_across_chunks(processor, tmp_path, monkeypatch):
+    import datetime
+    from openpyxl import Workbook
+    from utils import file_process
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['ID', 'CODE', 'CODE', None, 'DATE'])
+    sheet.append([1, 201908061302519700, 'a', 2.5, datetime.datetime(2024, 1, 2)])
+    sheet.append([2.0, None, 'b', None, datetime.datetime(2024, 1, 3)])
+    sheet.append([])
+    sheet.append([3, 7, None, 1, None])
+    sheet.append([])
+    path = tmp_path / "input.xlsx"
+    workbook.save(path)
+
+    monkeypatch.setattr(file_process, "CSV_CHUNK_SIZE", 2)
+    expected = pd.read_excel(path, engine='openpyxl', dtype=object)
+    pd.testing.assert_frame_equal(_stream_excel(processor, path), expected)
+
+
+def test_openpyxl_fallback_keeps_types_when_a_column_is_blank_in_one_chunk(processor, tmp_path, monkeypatch):
+    from openpyxl import Workbook
+    from utils import file_process
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['BOOKING_ID', 'AMOUNT'])
+    sheet.append([101, 10])
+    sheet.append([102, 20])
+    sheet.append([None, 30])  # second chunk: BOOKING_ID only blank here
+    sheet.append([None, 40])
+    sheet.append([105, 50])
+    path = tmp_path / "input.xlsx"
+    workbook.save(path)
+
+    monkeypatch.setattr(file_process, "CSV_CHUNK_SIZE", 2)
+    chunks = list(processor._stream_excel_rows(str(path)))
+
+    assert len(chunks) == 3
+    assert all((chunk.dtypes == object).all() for chunk in chunks)
+    booking_ids = pd.concat(chunks, ignore_index=True)['BOOKING_ID'].tolist()
+    assert booking_ids[:2] == [101, 102] and booking_ids[4] == 105
+    assert all(type(value) is int for value in booking_ids[:2] + booking_ids[4:])
+    assert pd.isna(booking_ids[2]) and pd.isna(booking_ids[3])
+
+
+def test_processing_error_is_not_reported_as_save_failure(processor, tmp_path, monkeypatch, caplog):
+    import threading
+    import time
+    from utils import file_process
+
+    pd.DataFrame({'HOTEL_INVOICE_PATH': [f"inv{i}.pdf" for i in range(200)]}).to_csv(tmp_path / "in.csv", index=False)
+    monkeypatch.setattr(file_process, "MAX_WORKERS", 2)
+    started = []
+    lock = threading.Lock()
+
+    def slow_transfer(self, idx, invoice_url, total_rows):
+        with lock:
+            started.append(invoice_url)
+        time.sleep(0.01)
+        return {'status': 'SUCCESS', 'transferred': True, 's3_link': invoice_url, 'file_hash': invoice_url}
+
+    def broken_complete(self, pending, stats, mongo_helper):
+        raise RuntimeError("mongo unavailable")
+
+    monkeypatch.setattr(file_process.FileProcessor, "_transfer_invoice", slow_transfer)
+    monkeypatch.setattr(file_process.FileProcessor, "_complete_chunk", broken_complete)
+
+    assert processor.process_file(str(tmp_path / "in.csv"), str(tmp_path / "out.csv")) is False
+    assert "Failed to read or process" in caplog.text
+    assert "Failed to save updated file" not in caplog.text
+    # Queued transfers were cancelled rather than all run to completion
+    assert len(started) < 200
+    assert not (tmp_path / "out.partial.csv").exists()
+
+
+def test_output_write_error_is_reported_as_save_failure(processor, tmp_path, caplog):
+    pd.DataFrame({'HOTEL_INVOICE_PATH': ['a.pdf']}).to_csv(tmp_path / "in.csv", index=False)
+    output = tmp_path / "missing_dir" / "out.csv"
+
+    assert processor.process_file(str(tmp_path / "in.csv"), str(output)) is False
+    assert "Failed to save updated file" in caplog.text
+    assert "Failed to read or process" not in caplog.text
+
+
+def test_csv_values_keep_one_type_across_chunks(processor, tmp_path, monkeypatch):
+    from utils import file_process
+
+    # The blank BOOKING_ID falls in the second chunk only
+    (tmp_path / "in.csv").write_text(
+        "HOTEL_INVOICE_PATH,BOOKING_ID,TOTAL INVOICE AMOUNT\n"
+        "inv0.pdf,101,10\ninv1.pdf,102,20.5\ninv2.pdf,103,30\n"
+        "inv3.pdf,104,40\ninv4.pdf,,50\ninv5.pdf,105,\n"
+        "inv6.pdf,106,70\n"
+    )
+    monkeypatch.setattr(file_process, "CSV_CHUNK_SIZE", 3)
+    output = tmp_path / "out.csv"
+
+    assert processor.process_file(str(tmp_path / "in.csv"), str(output)) is True
+
+    from conftest import FakePostgres
+    booking_ids = [record.get('booking_id') for record in FakePostgres.records]
+    assert booking_ids == ['101', '102', '103', '104', None, '105', '106']
+    assert pd.read_csv(output, dtype=str)['BOOKING_ID'].fillna('').tolist() == \
+        ['101', '102', '103', '104', '', '105', '106']
+    assert [record.get('gst_amount') for record in FakePostgres.records] == [10.0, 20.5, 30.0, 40.0, 50.0, None, 70.0]
+
+
+def _count_transfers(monkeypatch, fail=()):
+    """Record every _transfer_invoice call; URLs ending in one of `fail` fail once."""
+    import threading
+    from utils import file_process
+
+    calls = []
+    lock = threading.Lock()
+
+    def transfer(self, idx, invoice_url, total_rows):
+        with lock:
+            calls.append(invoice_url)
+            failing = invoice_url.endswith(fail) and calls.count(invoice_url) == 1
+        if failing:
+            return {'status': 'FAILED: download error', 'transferred': False}
+        return {'status': 'SUCCESS', 'transferred': True, 's3_link': invoice_url, 'file_hash': invoice_url[-5:]}
+
+    monkeypatch.setattr(file_process.FileProcessor, "_transfer_invoice", transfer)
+    return calls
+
+
+def _run_links(processor, tmp_path, links):
+    (tmp_path / "in.csv").write_text("HOTEL_INVOICE_PATH\n" + "\n".join(links) + "\n")
+    assert processor.process_file(str(tmp_path / "in.csv"), str(tmp_path / "out.csv")) is True
+    return pd.read_csv(tmp_path / "out.csv")
+
+
+def test_invoice_repeated_in_a_later_chunk_reuses_in_flight_transfer(processor, tmp_path, monkeypatch):
+    import threading
+    from utils import file_process
+
+    monkeypatch.setattr(file_process, "CSV_CHUNK_SIZE", 2)
+    calls = _count_transfers(monkeypatch)
+    transfer = file_process.FileProcessor._transfer_invoice
+    submit = file_process.FileProcessor._submit_chunk
+    second_chunk_queued = threading.Event()
+    submitted = []
+
+    def slow_transfer(self, idx, invoice_url, total_rows):
+        # Hold the first chunk's transfers until the next chunk has been queued
+        second_chunk_queued.wait(5)
+        return transfer(self, idx, invoice_url, total_rows)
+
+    def counting_submit(self, *args):
+        pending = submit(self, *args)
+        submitted.append(pending)
+        if len(submitted) == 2:
+            second_chunk_queued.set()
+        return pending
+
+    monkeypatch.setattr(file_process.FileProcessor, "_transfer_invoice", slow_transfer)
+    monkeypatch.setattr(file_process.FileProcessor, "_submit_chunk", counting_submit)
+
+    out = _run_links(processor, tmp_path, ['a.pdf', 'b.pdf', 'a.pdf', 'c.pdf'])
+
+    assert sorted(calls) == sorted(f"https://files.finkraft.ai/{name}" for name in ['a.pdf', 'b.pdf', 'c.pdf'])
+    assert out['file_hash'].tolist()[0] == out['file_hash'].tolist()[2]
+    assert (out['status'] == 'SUCCESS').all()
+
+
+def test_failed_transfer_is_retried_in_a_later_chunk(processor, tmp_path, monkeypatch):
+    from utils import file_process
+
+    monkeypatch.setattr(file_process, "CSV_CHUNK_SIZE", 2)
+    calls = _count_transfers(monkeypatch, fail=('a.pdf',))
+
+    out = _run_links(processor, tmp_path, ['a.pdf', 'b.pdf', 'c.pdf', 'd.pdf', 'a.pdf'])
+
+    assert calls.count("https://files.finkraft.ai/a.pdf") == 2
+    assert out['status'].tolist() == ['FAILED: download error', 'SUCCESS', 'SUCCESS', 'SUCCESS', 'SUCCESS']
+
+
+def test_transfer_cache_evicts_oldest_entry_at_the_cap(processor, tmp_path, monkeypatch):
+    from utils import file_process
+
+    monkeypatch.setattr(file_process, "CSV_CHUNK_SIZE", 1)
+    monkeypatch.setattr(file_process, "TRANSFER_CACHE_SIZE", 2)
+    calls = _count_transfers(monkeypatch)
+
+    _run_links(processor, tmp_path, ['a.pdf', 'b.pdf', 'b.pdf', 'c.pdf', 'b.pdf', 'a.pdf'])
+
+    names = [url.rsplit('/', 1)[1] for url in calls]
+    # b stays cached; a was evicted when c arrived, so it is transferred again
+    assert sorted(names) == ['a.pdf', 'a.pdf', 'b.pdf', 'c.pdf']
@@ -0,0 +1,86 @@
+import datetime
+
+import bson
+import pandas as pd
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from utils.mongodb_process import MongoDBProcess
+
+
+class _Result:
+    def __init__(self, inserted_id=None, inserted_ids=None):
+        self.inserted_id = inserted_id
+        self.inserted_ids = inserted_ids
+        self.acknowledged = True
+
+
+class EncodingCollection:
+    """In-memory collection that BSON-encodes documents the way pymongo does."""
+
+    def __init__(self):
+        self.stored = {}
+
+    def _store(self, doc):
+        doc.setdefault('_id', ObjectId())
+        if doc['_id'] in self.stored:
+            raise DuplicateKeyError("E11000 duplicate key", 11000, {'keyPattern': {'_id': 1}})
+        bson.encode(doc)
+        self.stored[doc['_id']] = doc
+
+    def insert_many(self, docs, ordered=False):
+        # Documents before an unencodable one have already been sent
+        for doc in docs:
+            self._store(doc)
+        return _Result(inserted_ids=[doc['_id'] for doc in docs])
+
+    def insert_one(self, doc):
+        self._store(doc)
+        return _Result(inserted_id=doc['_id'])
+
+
+def _mongo_with(collection):
+    mongo = MongoDBProcess.__new__(MongoDBProcess)
+    mongo.client = None
+    mongo.collection = collection
+    return mongo
+
+
+def test_unencodable_documents_fail_alone():
+    collection = EncodingCollection()
+    docs = [
+        {'row': 0, 'date': pd.Timestamp('2024-01-02')},
+        {'row': 1, 'date': pd.NaT},
+        {'row': 2, 'date': datetime.date(2024, 1, 3)},
+        {'row': 3, 'date': None},
+    ]
+
+    ids = _mongo_with(collection).insert_many_invoice_data(docs)
+
+    assert ids[0] is not None and ids[3] is not None
+    assert ids[1] is None and ids[2] is None
+    # The document stored before the batch failed is reported, not inserted twice
+    assert sorted(doc['row'] for doc in collection.stored.values()) == [0, 3]
+
+
+def test_blank_date_cell_fails_only_its_row(processor, tmp_path, monkeypatch):
+    from utils import file_process
+
+    # A datetime column with a blank cell, as pandas reads it: the blank becomes NaT
+    frame = pd.DataFrame({
+        'HOTEL_INVOICE_PATH': ['a.pdf', 'b.pdf', 'c.pdf'],
+        'CHECK_IN': pd.to_datetime(['2024-01-02', None, '2024-01-04']),
+    })
+    monkeypatch.setattr(file_process.FileProcessor, "_read_input", lambda self, path: iter([frame]))
+    (tmp_path / "in.csv").write_text("unused\n")
+
+    collection = EncodingCollection()
+    monkeypatch.setattr(file_process, "MongoDBProcess", lambda: _mongo_with(collection))
+    output = tmp_path / "out.csv"
+
+    assert processor.process_file(str(tmp_path / "in.csv"), str(output)) is True
+
+    status = pd.read_csv(output)['status'].tolist()
+    assert status[1] == "FAILED: MongoDB insert failed"
+    assert not status[0].startswith("FAILED") and not status[2].startswith("FAILED")
+    assert len(collection.stored) == 2
@@ -0,0 +1,241 @@
+import csv
+import re
+
+import psycopg2
+import pytest
+
+from utils import postgres_process
+from utils.postgres_process import PostgresProcess
+
+COLUMNS_RE = re.compile(r'INSERT INTO \S+ \(([^)]*)\)')
+
+
+class FakeDatabase:
+    """hotel_invoice as file_hash -> row, with just enough SQL to drive PostgresProcess."""
+
+    def __init__(self):
+        self.rows = {}
+        self.next_id = 1
+        self.statements = []
+        self.fail_when = None  # predicate on a row dict; a match raises DataError
+
+    def upsert(self, rows):
+        """Apply one INSERT ... ON CONFLICT (file_hash) statement; return (id, inserted) per row."""
+        hashes = [row.get('file_hash') for row in rows if row.get('file_hash') is not None]
+        if len(hashes) != len(set(hashes)):
+            raise psycopg2.ProgrammingError("ON CONFLICT DO UPDATE command cannot affect row a second time")
+        results = []
+        for row in rows:
+            if self.fail_when and self.fail_when(row):
+                raise psycopg2.DataError(f"bad row {row}")
+            file_hash = row.get('file_hash')
+            if file_hash is not None and file_hash in self.rows:
+                results.append((self.rows[file_hash]['id'], False))
+                continue
+            stored = dict(row, id=self.next_id)
+            self.next_id += 1
+            self.rows[file_hash if file_hash is not None else f"null-{stored['id']}"] = stored
+            results.append((stored['id'], True))
+        return results
+
+
+def _columns(sql):
+    return [name.strip().strip('"') for name in COLUMNS_RE.search(sql).group(1).split(',')]
+
+
+def _row(columns, values):
+    # Trailing literal columns (status, updated_on) are filled in by SQL, not parameters
+    return dict(zip(columns, values))
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.staging = None
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params=None):
+        self.db.statements.append(' '.join(sql.split()))
+        if sql.lstrip().startswith(('DROP', 'CREATE')):
+            return
+        if 'FROM pg_temp.' in sql:
+            columns = _columns(sql)[:-1]
+            rows = [_row(columns, values) for values in self.staging]
+            self.result = [(record_id, inserted, row['file_hash'])
+                           for row, (record_id, inserted) in zip(rows, self.db.upsert(rows))]
+            # INSERT ... SELECT gives no ordering guarantee
+            self.result.reverse()
+            return
+        self.result = self.db.upsert([_row(_columns(sql), params)])
+
+    def copy_expert(self, sql, buf):
+        self.db.statements.append(sql)
+        self.staging = list(csv.reader(buf))
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+class FakeConnection:
+    closed = 0
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.snapshot = ({key: dict(row) for key, row in self.db.rows.items()}, self.db.next_id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.db.rows, self.db.next_id = self.snapshot
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+
+class FakePool:
+    closed = False
+
+    def __init__(self, db):
+        self.db = db
+
+    def getconn(self):
+        return FakeConnection(self.db)
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        self.closed = True
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = FakeDatabase()
+
+    def fake_execute_values(cur, sql, argslist, template=None, page_size=100, fetch=False):
+        cur.db.statements.append(' '.join(sql.split()))
+        columns = _columns(sql)
+        return cur.db.upsert([_row(columns, values) for values in argslist])
+
+    monkeypatch.setattr(postgres_process, "_pool", FakePool(database))
+    monkeypatch.setattr(postgres_process, "execute_values", fake_execute_values)
+    return database
+
+
+def test_bulk_insert_maps_ids_back_to_input_rows(db):
+    db.upsert([{'file_hash': 'old', 'source_id': 'm0'}])
+    records = [
+        {'source_id': 'm1', 'file_hash': 'h1'},
+        {'source_id': 'm2', 'file_hash': 'old'},
+        {'source_id': 'm3', 'file_hash': 'h3', 'remarks': 'x'},
+        {'source_id': 'm4', 'file_hash': 'h1'},
+        {'source_id': 'm5', 'file_hash': 'h5'},
+    ]
+
+    results = PostgresProcess.insert_full_invoice_data_bulk(records)
+
+    stored_ids = {row['source_id']: str(row['id']) for row in db.rows.values()}
+    assert results == [
+        {'id': stored_ids['m1'], 'is_duplicate': False},
+        {'id': stored_ids['m0'], 'is_duplicate': True},
+        {'id': stored_ids['m3'], 'is_duplicate': False},
+        {'id': stored_ids['m1'], 'is_duplicate': True},
+        {'id': stored_ids['m5'], 'is_duplicate': False},
+    ]
+    # One statement per field set; the repeated hash is sent once
+    inserts = [s for s in db.statements if s.startswith('INSERT')]
+    assert len(inserts) == 2
+    assert db.rows['h3']['remarks'] == 'x'
+
+
+def test_bulk_insert_falls_back_to_single_records(db):
+    db.fail_when = lambda row: row.get('source_id') == 'bad'
+    records = [
+        {'source_id': 'm1', 'file_hash': 'h1'},
+        {'source_id': 'bad', 'file_hash': 'h2'},
+        {'source_id': 'm3', 'file_hash': 'h3'},
+    ]
+
+    results = PostgresProcess.insert_full_invoice_data_bulk(records)
+
+    assert results[1] is None
+    assert results[0] == {'id': str(db.rows['h1']['id']), 'is_duplicate': False}
+    assert results[2] == {'id': str(db.rows['h3']['id']), 'is_duplicate': False}
+    assert set(db.rows) == {'h1', 'h3'}
+
+
+def test_bulk_insert_does_not_retry_connection_failures(db, monkeypatch):
+    calls = []
+
+    def unreachable(cur, *args, **kwargs):
+        calls.append(1)
+        raise psycopg2.OperationalError("server closed the connection")
+
+    monkeypatch.setattr(postgres_process, "execute_values", unreachable)
+    monkeypatch.setattr(PostgresProcess, "insert_full_invoice_data",
+                        staticmethod(lambda record: pytest.fail("per-record retry after OperationalError")))
+
+    records = [{'source_id': 'm1', 'file_hash': 'h1'}, {'source_id': 'm2', 'file_hash': 'h2'}]
+    assert PostgresProcess.insert_full_invoice_data_bulk(records) == [None, None]
+    assert len(calls) == 1
+
+
+def test_insert_many_file_metadata_dedupes_hashes(db):
+    db.upsert([{'file_hash': 'old', 'file_url': 'u0'}])
+    rows = [
+        ('u1', 'src', 'client', 'h1'),
+        ('u2', 'src', 'client', 'old'),
+        ('u3', 'src', 'client', 'h1'),
+        ('u4', 'src', 'client', None),
+        ('u5', 'src', 'client', None),
+    ]
+
+    results = PostgresProcess.insert_many_file_metadata(rows)
+
+    ids = {row['file_url']: str(row['id']) for row in db.rows.values()}
+    assert results == [
+        {'id': ids['u1'], 'is_duplicate': False},
+        {'id': ids['u0'], 'is_duplicate': True},
+        {'id': ids['u1'], 'is_duplicate': True},
+        {'id': ids['u4'], 'is_duplicate': False},
+        {'id': ids['u5'], 'is_duplicate': False},
+    ]
+
+
+def test_large_groups_are_copied_through_the_staging_table(db, monkeypatch):
+    monkeypatch.setattr(postgres_process, "COPY_MIN_ROWS", 3)
+    db.upsert([{'file_hash': 'old', 'source_id': 'm0'}])
+    records = [
+        {'source_id': 'm1', 'file_hash': 'h1'},
+        {'source_id': 'm2', 'file_hash': 'old'},
+        {'source_id': 'm3', 'file_hash': 'h3'},
+        {'source_id': 'm4', 'file_hash': 'h1'},
+        {'source_id': 'm5', 'file_hash': 'h5', 'remarks': 'small group'},
+    ]
+
+    results = PostgresProcess.insert_full_invoice_data_bulk(records)
+
+    stored_ids = {row['source_id']: str(row['id']) for row in db.rows.values()}
+    assert results == [
+        {'id': stored_ids['m1'], 'is_duplicate': False},
+        {'id': stored_ids['m0'], 'is_duplicate': True},
+        {'id': stored_ids['m3'], 'is_duplicate': False},
+        {'id': stored_ids['m1'], 'is_duplicate': True},
+        {'id': stored_ids['m5'], 'is_duplicate': False},
+    ]
+    copies = [s for s in db.statements if s.startswith('COPY')]
+    assert copies == ['COPY pg_temp.hotel_invoice_staging ("source_id", "file_hash") FROM STDIN WITH (FORMAT CSV)']
+    assert 'DROP TABLE IF EXISTS pg_temp.hotel_invoice_staging' in db.statements
+    # The group below COPY_MIN_ROWS still goes through execute_values
+    assert any(s.startswith('INSERT') and '"remarks"' in s and 'VALUES %s' in s for s in db.statements)